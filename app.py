@@ -1,40 +1,78 @@
+from contextlib import asynccontextmanager
 from hustleforge_bot import main
-from telegram.ext import Application
-from fastapi import FastAPI, Request
+from logging_setup import setup_logging
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import ORJSONResponse
+from telegram import Update
+import asyncio
 import logging
+import orjson
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
-application = None
+# Seconds to wait for in-flight updates on shutdown
+DRAIN_TIMEOUT = 25
 
-@app.on_event("startup")
-async def startup_event():
-    global application
+def _on_update_done(task):
+    """Forget a finished update task and log its failure, if any."""
+    app.state.pending.discard(task)
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        logger.error("Error processing update: %s", exc, exc_info=exc)
+
+async def _drain_pending(pending):
+    """Give in-flight updates a bounded amount of time to finish."""
+    if not pending:
+        return
+    logger.info("Draining %s in-flight updates", len(pending))
+    try:
+        await asyncio.wait_for(asyncio.gather(*pending, return_exceptions=True), timeout=DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("Gave up on %s updates after %ss", len(pending), DRAIN_TIMEOUT)
+
+@asynccontextmanager
+async def lifespan(app):
     try:
         logger.info("Initializing Telegram Application")
         application = main()
         await application.initialize()
+        await application.start()
         logger.info("Telegram Application initialized successfully")
     except Exception as e:
-        logger.error(f"Error initializing application: {str(e)}", exc_info=True)
+        logger.error("Error initializing application: %s", e, exc_info=True)
         raise
+    app.state.application = application
+    app.state.pending = set()
+    try:
+        yield
+    finally:
+        await _drain_pending(app.state.pending)
+        await application.stop()
+        await application.shutdown()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 @app.get("/")
 async def root():
     logger.info("Received GET request to root")
     return {"message": "HustleForge AI Bot is running! Access via Telegram."}
 
-@app.post("/webhook")
+@app.post("/webhook", response_class=Response)
 async def webhook(request: Request):
     try:
         logger.info("Received webhook request")
-        update = await request.json()
-        logger.debug(f"Webhook update: {update}")
-        await application.process_update(update)
-        logger.info("Webhook processed successfully")
-        return {"status": "ok"}
+        application = request.app.state.application
+        payload = orjson.loads(await request.body())
+        logger.debug("Webhook update: %s", payload)
+        update = Update.de_json(payload, application.bot)
+        # Ack right away so Telegram isn't held up by slow handlers
+        task = asyncio.create_task(application.process_update(update))
+        request.app.state.pending.add(task)
+        task.add_done_callback(_on_update_done)
+        return Response(status_code=200)
     except Exception as e:
-        logger.error(f"Webhook error: {str(e)}", exc_info=True)
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        logger.error("Webhook error: %s", e, exc_info=True)
+        return ORJSONResponse({"status": "error", "message": str(e)})
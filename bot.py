@@ -1,500 +1,1450 @@
-```python
-   import os
-   import telebot
-   import google.generativeai as genai
-   import logging
-   import re
-   from enum import Enum
-   from dotenv import load_dotenv
-   import requests
-   import time
-   from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-
-   # Load .env file
-   load_dotenv()
-
-   # Set up logging
-   logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-   logger = logging.getLogger(__name__)
-
-   # Environment variables
-   TELEGRAM_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-   GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-   ENV = os.getenv('ENV', 'development')
-
-   # Validate environment variables
-   if not TELEGRAM_TOKEN:
-       logger.error("TELEGRAM_BOT_TOKEN not set")
-       raise ValueError("TELEGRAM_BOT_TOKEN not set")
-   if not GEMINI_API_KEY:
-       logger.error("GEMINI_API_KEY not set")
-       raise ValueError("GEMINI_API_KEY not set")
-
-   # Initialize bot with custom timeout
-   bot = telebot.TeleBot(TELEGRAM_TOKEN, parse_mode='Markdown')
-
-   # Gemini setup
-   try:
-       logger.info("Configuring Gemini API")
-       genai.configure(api_key=GEMINI_API_KEY)
-       model = genai.GenerativeModel('gemini-2.5-flash')
-       logger.info("Gemini API configured successfully")
-   except Exception as e:
-       logger.error(f"Gemini initialization error: {str(e)}", exc_info=True)
-       raise
-
-   # Conversation states
-   class State(Enum):
-       SKILLS = 1
-       LOCATION = 2
-       BUDGET = 3
-       GOALS = 4
-       ASK_QUESTION = 5
-       EXPLORE_IDEA = 6
-       CUSTOM_IDEA = 7
-
-   # Store user data
-   user_data = {}
-
-   def split_message(text, max_length=4000):
-       """Split a long message into parts under max_length, preserving formatting."""
-       lines = text.split('\n')
-       parts = []
-       current_part = []
-       current_length = 0
-
-       for line in lines:
-           if current_length + len(line) + 1 > max_length:
-               parts.append('\n'.join(current_part))
-               current_part = [line]
-               current_length = len(line) + 1
-           else:
-               current_part.append(line)
-               current_length += len(line) + 1
-       if current_part:
-           parts.append('\n'.join(current_part))
-       return parts
-
-   def clean_response(text):
-       """Clean Gemini response to ensure valid Markdown and avoid parse errors."""
-       # Replace ### with bold and ensure proper Markdown
-       text = re.sub(r'#+ \d+\.\s*([^\n]+)', r'**\1**', text)
-       # Fix unbalanced Markdown characters
-       text = re.sub(r'([*_]{1,2})([^\s*_])', r'\1 \2', text)
-       # Remove problematic characters
-       text = re.sub(r'[^\x00-\x7F]+', ' ', text)  # Remove non-ASCII characters
-       # Ensure single newlines
-       lines = [line.strip() for line in text.split('\n') if line.strip()]
-       return '\n'.join(lines)
-
-   def clean_url(url):
-       """Ensure URL is valid for Telegram's Markdown parser."""
-       if not url.startswith(('http://', 'https://')):
-           url = 'https://' + url
-       return url
-
-   def extract_idea_headings(text):
-       """Extract idea headings from Gemini response."""
-       headings = []
-       for line in text.split('\n'):
-           match = re.match(r'\*\*(.+?)\*\*', line)
-           if match:
-               headings.append(match.group(1).strip())
-       return headings[:3]  # Limit to 3 ideas
-
-   def retry_send_message(func, *args, retries=3, delay=10, timeout=60, **kwargs):
-       """Retry sending a message with exponential backoff."""
-       for attempt in range(retries):
-           try:
-               return func(*args, timeout=timeout, **kwargs)
-           except (requests.exceptions.RequestException, telebot.apihelper.ApiTelegramException) as e:
-               logger.warning(f"Attempt {attempt+1}/{retries} failed: {str(e)}")
-               if attempt < retries - 1:
-                   time.sleep(delay * (2 ** attempt))
-               else:
-                   logger.error(f"Failed after {retries} attempts: {str(e)}")
-                   raise
-
-   @bot.message_handler(commands=['start'])
-   def start(message):
-       logger.info(f"Received /start command from user {message.from_user.id}")
-       try:
-           user_data.pop(message.from_user.id, None)
-           retry_send_message(
-               bot.send_message,
-               message.chat.id,
-               "Welcome to AnzaBiz AI! Let's find you some awesome side hustle ideas in Kenya. 😊\n\nFirst, tell me: What skills do you have? (e.g., cooking, phone repair, graphic design)"
-           )
-           retry_send_message(bot.set_chat_menu_button, message.chat.id, None)
-           user_data[message.from_user.id] = {'state': State.SKILLS}
-           logger.info("Sent welcome message")
-       except Exception as e:
-           logger.error(f"Error in start handler: {str(e)}", exc_info=True)
-           retry_send_message(bot.send_message, message.chat.id, "Sorry, something went wrong. Please try again.")
-
-   @bot.message_handler(commands=['cancel'])
-   def cancel(message):
-       logger.info(f"Received /cancel command from user {message.from_user.id}")
-       try:
-           user_data.pop(message.from_user.id, None)
-           retry_send_message(bot.send_message, message.chat.id, "Conversation cancelled.")
-           logger.info("Conversation cancelled")
-       except Exception as e:
-           logger.error(f"Error in cancel handler: {str(e)}", exc_info=True)
-           retry_send_message(bot.send_message, message.chat.id, "Sorry, something went wrong. Please try again.")
-
-   @bot.message_handler(func=lambda message: True)
-   def handle_message(message):
-       user_id = message.from_user.id
-       logger.debug(f"Processing message from {user_id}: {message.text}")
-       
-       # Handle commands separately
-       if message.text.startswith('/'):
-           if message.text not in ['/start', '/cancel']:
-               retry_send_message(
-                   bot.send_message,
-                   message.chat.id,
-                   "Please enter the requested information (e.g., skills, location) or use /start to begin, /cancel to reset."
-               )
-           return
-
-       # Initialize user data if not present
-       if user_id not in user_data or 'state' not in user_data[user_id]:
-           keyboard = InlineKeyboardMarkup()
-           keyboard.add(InlineKeyboardButton("Start Now 🚀", callback_data="start_new"))
-           keyboard.add(InlineKeyboardButton("Learn More 🌐", callback_data="learn_more"))
-           retry_send_message(
-               bot.send_message,
-               message.chat.id,
-               "Hey there! I’m AnzaBiz AI, your side hustle guru in Kenya! 😎 Ready to find ideas that match your skills?",
-               reply_markup=keyboard
-           )
-           return
-
-       state = user_data[user_id]['state']
-       try:
-           if state == State.SKILLS:
-               user_data[user_id]['skills'] = message.text
-               logger.info(f"Skills received: {message.text}")
-               retry_send_message(
-                   bot.send_message,
-                   message.chat.id,
-                   "Great! Where are you located? (e.g., Nairobi, Mombasa)"
-               )
-               user_data[user_id]['state'] = State.LOCATION
-           elif state == State.LOCATION:
-               user_data[user_id]['location'] = message.text
-               logger.info(f"Location received: {message.text}")
-               retry_send_message(
-                   bot.send_message,
-                   message.chat.id,
-                   "What's your budget in KES? (e.g., 5000, 10000, or any amount)"
-               )
-               user_data[user_id]['state'] = State.BUDGET
-           elif state == State.BUDGET:
-               user_data[user_id]['budget'] = message.text
-               logger.info(f"Budget received: {message.text}")
-               retry_send_message(
-                   bot.send_message,
-                   message.chat.id,
-                   "What are your goals? (e.g., earn 20000/month, start a business)"
-               )
-               user_data[user_id]['state'] = State.GOALS
-           elif state == State.GOALS:
-               user_data[user_id]['goals'] = message.text
-               logger.info(f"Goals received: {message.text}")
-               prompt = (
-                   f"Generate 3 concise side hustle ideas for someone in {user_data[user_id]['location']} with skills in "
-                   f"{user_data[user_id]['skills']}, a budget of {user_data[user_id]['budget']} KES, and goals of {user_data[user_id]['goals']}. "
-                   f"Each idea should be under 100 words, use bold Markdown (**Idea 1: Title**, **Idea 2: Title**, **Idea 3: Title**) for headings, "
-                   f"and include single newlines between ideas and paragraphs for readability. Avoid ### or other headers. Use only ASCII characters."
-               )
-               logger.info(f"Sending prompt to Gemini: {prompt}")
-               try:
-                   response = model.generate_content(prompt, request_options={"timeout": 30})
-                   if not response.text:
-                       raise ValueError("Empty response from Gemini")
-                   cleaned_response = clean_response(response.text)
-                   logger.info(f"Gemini response: {cleaned_response}")
-                   user_data[user_id]['ideas'] = cleaned_response
-                   user_data[user_id]['idea_headings'] = extract_idea_headings(cleaned_response)
-                   messages = split_message(f"Here are your side hustle ideas:\n{cleaned_response}")
-                   for i, msg in enumerate(messages, 1):
-                       retry_send_message(
-                           bot.send_message,
-                           message.chat.id,
-                           msg if i == 1 else f"Part {i}:\n{msg}"
-                       )
-               except Exception as e:
-                   logger.error(f"Gemini error: {str(e)}", exc_info=True)
-                   retry_send_message(
-                       bot.send_message,
-                       message.chat.id,
-                       "Sorry, I couldn't generate ideas right now. Try again or use /cancel."
-                   )
-                   user_data.pop(user_id, None)
-                   return
-
-               keyboard = InlineKeyboardMarkup()
-               for i, heading in enumerate(user_data[user_id]['idea_headings'], 1):
-                   keyboard.add(InlineKeyboardButton(f"{heading} 🌟", callback_data=f"explore_idea_{i}"))
-               retry_send_message(
-                   bot.send_message,
-                   message.chat.id,
-                   "Choose your best idea to explore further:",
-                   reply_markup=keyboard
-               )
-               user_data[user_id]['state'] = State.EXPLORE_IDEA
-               user_data[user_id]['explored_ideas'] = []
-           elif state == State.EXPLORE_IDEA:
-               user_data[user_id]['custom_idea'] = message.text
-               logger.info(f"Custom idea received: {message.text}")
-               prompt = (
-                   f"Evaluate the following side hustle idea for someone in {user_data[user_id]['location']} with skills in "
-                   f"{user_data[user_id]['skills']}, a budget of {user_data[user_id]['budget']} KES, and goals of {user_data[user_id]['goals']}: "
-                   f"{message.text}. Provide a concise feasibility analysis (under 150 words) with steps to start, potential challenges, and budget use. "
-                   f"Use Markdown for readability, avoid ### headers, and use only ASCII characters."
-               )
-               logger.info(f"Sending custom idea prompt to Gemini: {prompt}")
-               try:
-                   response = model.generate_content(prompt, request_options={"timeout": 30})
-                   if not response.text:
-                       raise ValueError("Empty response from Gemini")
-                   cleaned_response = clean_response(response.text)
-                   logger.info(f"Gemini response: {cleaned_response}")
-                   messages = split_message(cleaned_response)
-                   for i, msg in enumerate(messages, 1):
-                       retry_send_message(
-                           bot.send_message,
-                           message.chat.id,
-                           msg if i == 1 else f"Part {i}:\n{msg}"
-                       )
-               except Exception as e:
-                   logger.error(f"Gemini error: {str(e)}", exc_info=True)
-                   retry_send_message(
-                       bot.send_message,
-                       message.chat.id,
-                       "Sorry, I couldn't evaluate your idea right now. Try again or use /cancel."
-                   )
-                   user_data.pop(user_id, None)
-                   return
-
-               keyboard = InlineKeyboardMarkup()
-               keyboard.add(InlineKeyboardButton("Ask a Question ❓", callback_data="ask_question"))
-               keyboard.add(InlineKeyboardButton("Close Conversation 🛑", callback_data="end_conversation"))
-               retry_send_message(
-                   bot.send_message,
-                   message.chat.id,
-                   "What would you like to do next?",
-                   reply_markup=keyboard
-               )
-               user_data[user_id]['state'] = State.ASK_QUESTION
-           elif state == State.ASK_QUESTION:
-               user_data[user_id]['question'] = message.text
-               logger.info(f"Question received: {message.text}")
-               prompt = (
-                   f"Answer the following question about side hustle ideas for someone in {user_data[user_id]['location']} with skills in "
-                   f"{user_data[user_id]['skills']}, a budget of {user_data[user_id]['budget']} KES, and goals of {user_data[user_id]['goals']}: "
-                   f"{message.text}. Keep the answer under 150 words, use Markdown for readability, avoid ### headers, and use only ASCII characters."
-               )
-               logger.info(f"Sending question prompt to Gemini: {prompt}")
-               try:
-                   response = model.generate_content(prompt, request_options={"timeout": 30})
-                   if not response.text:
-                       raise ValueError("Empty response from Gemini")
-                   cleaned_response = clean_response(response.text)
-                   logger.info(f"Gemini response: {cleaned_response}")
-                   messages = split_message(cleaned_response)
-                   for i, msg in enumerate(messages, 1):
-                       retry_send_message(
-                           bot.send_message,
-                           message.chat.id,
-                           msg if i == 1 else f"Part {i}:\n{msg}"
-                       )
-               except Exception as e:
-                   logger.error(f"Gemini error: {str(e)}", exc_info=True)
-                   retry_send_message(
-                       bot.send_message,
-                       message.chat.id,
-                       "Sorry, I couldn't answer right now. Try again or use /cancel."
-                   )
-                   user_data.pop(user_id, None)
-                   return
-
-               keyboard = InlineKeyboardMarkup()
-               keyboard.add(InlineKeyboardButton("Ask Another Question ❓", callback_data="ask_question"))
-               remaining_ideas = [i for i in range(1, 4) if i not in user_data[user_id]['explored_ideas']]
-               for i in remaining_ideas:
-                   heading = user_data[user_id]['idea_headings'][i-1]
-                   keyboard.add(InlineKeyboardButton(f"Explore {heading} 🌟", callback_data=f"explore_idea_{i}"))
-               if not remaining_ideas:
-                   keyboard.add(InlineKeyboardButton("Have Your Own Idea? 💡", callback_data="custom_idea"))
-               keyboard.add(InlineKeyboardButton("Close Conversation 🛑", callback_data="end_conversation"))
-               retry_send_message(
-                   bot.send_message,
-                   message.chat.id,
-                   "Anything else you'd like to do?",
-                   reply_markup=keyboard
-               )
-               if not remaining_ideas:
-                   user_data[user_id]['state'] = State.CUSTOM_IDEA
-       except Exception as e:
-           logger.error(f"Error in message handler: {str(e)}", exc_info=True)
-           retry_send_message(
-               bot.send_message,
-               message.chat.id,
-               f"Error: {str(e)}. Please try again or use /cancel."
-           )
-           user_data.pop(user_id, None)
-
-   @bot.callback_query_handler(func=lambda call: True)
-   def callback_handler(call):
-       user_id = call.from_user.id
-       goals = user_data.get(user_id, {}).get('goals', '')
-       try:
-           if call.data == "start_new":
-               retry_send_message(
-                   bot.send_message,
-                   call.message.chat.id,
-                   "Starting new conversation..."
-               )
-               start(call.message)
-           elif call.data == "learn_more":
-               website_url = clean_url("https://www.linkedin.com/in/mwaura-wambiru")
-               retry_send_message(
-                   bot.send_message,
-                   call.message.chat.id,
-                   f"Discover more at our website: {website_url} (explore our expert plans!)"
-               )
-           elif call.data.startswith("explore_idea_"):
-               idea_num = int(call.data.split('_')[-1])
-               if idea_num in user_data[user_id].get('explored_ideas', []):
-                   retry_send_message(
-                       bot.send_message,
-                       call.message.chat.id,
-                       "You've already explored this idea. Choose another or ask a question!"
-                   )
-                   return
-               user_data[user_id]['explored_ideas'] = user_data[user_id].get('explored_ideas', []) + [idea_num]
-               idea_heading = user_data[user_id]['idea_headings'][idea_num-1]
-               prompt = (
-                   f"Provide a detailed breakdown for the side hustle idea '{idea_heading}' for someone in {user_data[user_id]['location']} with skills in "
-                   f"{user_data[user_id]['skills']}, a budget of {user_data[user_id]['budget']} KES, and goals of {user_data[user_id]['goals']}. "
-                   f"Include steps to start, potential challenges, and how to use the budget, in under 150 words. Use Markdown for readability, avoid ### headers, and use only ASCII characters."
-               )
-               logger.info(f"Sending explore idea prompt to Gemini: {prompt}")
-               try:
-                   response = model.generate_content(prompt, request_options={"timeout": 30})
-                   if not response.text:
-                       raise ValueError("Empty response from Gemini")
-                   cleaned_response = clean_response(response.text)
-                   logger.info(f"Gemini response: {cleaned_response}")
-                   messages = split_message(cleaned_response)
-                   for i, msg in enumerate(messages, 1):
-                       retry_send_message(
-                           bot.send_message,
-                           call.message.chat.id,
-                           msg if i == 1 else f"Part {i}:\n{msg}"
-                       )
-               except Exception as e:
-                   logger.error(f"Gemini error: {str(e)}", exc_info=True)
-                   retry_send_message(
-                       bot.send_message,
-                       call.message.chat.id,
-                       "Sorry, I couldn't explore this idea right now. Try again or use /cancel."
-                   )
-                   user_data.pop(user_id, None)
-                   return
-
-               keyboard = InlineKeyboardMarkup()
-               keyboard.add(InlineKeyboardButton("Ask a Question ❓", callback_data="ask_question"))
-               remaining_ideas = [i for i in range(1, 4) if i not in user_data[user_id]['explored_ideas']]
-               for i in remaining_ideas:
-                   heading = user_data[user_id]['idea_headings'][i-1]
-                   keyboard.add(InlineKeyboardButton(f"Explore {heading} 🌟", callback_data=f"explore_idea_{i}"))
-               if not remaining_ideas:
-                   keyboard.add(InlineKeyboardButton("Have Your Own Idea? 💡", callback_data="custom_idea"))
-               keyboard.add(InlineKeyboardButton("Close Conversation 🛑", callback_data="end_conversation"))
-               retry_send_message(
-                   bot.send_message,
-                   call.message.chat.id,
-                   "What would you like to do next?",
-                   reply_markup=keyboard
-               )
-               user_data[user_id]['state'] = State.ASK_QUESTION if remaining_ideas else State.CUSTOM_IDEA
-           elif call.data == "custom_idea":
-               retry_send_message(
-                   bot.send_message,
-                   call.message.chat.id,
-                   "Awesome! What's your own side hustle idea? (e.g., start a small shop, offer tutoring)"
-               )
-               user_data[user_id]['state'] = State.EXPLORE_IDEA
-           elif call.data == "ask_question":
-               retry_send_message(
-                   bot.send_message,
-                   call.message.chat.id,
-                   "Sure! What question do you have about the ideas?"
-               )
-               user_data[user_id]['state'] = State.ASK_QUESTION
-           elif call.data == "end_conversation":
-               upsell = "To hit big goals like yours, our Expert Hustle Coach can help!" if any(x in goals.lower() for x in ['30000', '30,000', '50000', '50,000']) else ""
-               keyboard = InlineKeyboardMarkup()
-               keyboard.add(InlineKeyboardButton("Full Strategy (KES 500) 💼", callback_data="premium_strategy"))
-               keyboard.add(InlineKeyboardButton("Talk to an Expert 🌐", callback_data="talk_expert"))
-               keyboard.add(InlineKeyboardButton("End Conversation 🛑", callback_data="final_end"))
-               keyboard.add(InlineKeyboardButton("Share with Friends 📣", callback_data="share_friends"))
-               retry_send_message(
-                   bot.send_message,
-                   call.message.chat.id,
-                   f"Thanks for exploring with AnzaBiz AI! {upsell}\nLoved these ideas? Take the next step to start earning faster!",
-                   reply_markup=keyboard
-               )
-           elif call.data == "premium_strategy":
-               retry_send_message(
-                   bot.send_message,
-                   call.message.chat.id,
-                   "For a full strategy with Expert Hustle Coach guidance (KES 500), pay via M-Pesa to 0721494836. Send receipt to start."
-               )
-           elif call.data == "talk_expert":
-               website_url = clean_url("https://www.linkedin.com/in/mwaura-wambiru")
-               retry_send_message(
-                   bot.send_message,
-                   call.message.chat.id,
-                   f"Connect with our Expert Hustle Coach at {website_url} to unlock personalized guidance!"
-               )
-           elif call.data == "final_end":
-               retry_send_message(
-                   bot.send_message,
-                   call.message.chat.id,
-                   "Thanks for using AnzaBiz AI! Start again anytime with /start. 😊"
-               )
-               user_data.pop(user_id, None)
-           elif call.data == "share_friends":
-               website_url = clean_url("https://www.linkedin.com/in/mwaura-wambiru")
-               retry_send_message(
-                   bot.send_message,
-                   call.message.chat.id,
-                   f"Share AnzaBiz AI with friends! Invite 3 friends to @AnzaBiz_bot and get a free KES 100 summary. Visit https://www.linkedin.com/in/mwaura-wambiru/ for details."
-               )
-           else:
-               retry_send_message(
-                   bot.send_message,
-                   call.message.chat.id,
-                   "Sorry, something went wrong. Try again."
-               )
-       except Exception as e:
-           logger.error(f"Error in callback handler: {str(e)}", exc_info=True)
-           retry_send_message(
-               bot.send_message,
-               call.message.chat.id,
-               "Sorry, something went wrong. Try again."
-           )
-
-   if __name__ == '__main__':
-       logger.info("Starting bot in polling mode")
-       while True:
-           try:
-               bot.infinity_polling(timeout=60, long_polling_timeout=60)
-           except Exception as e:
-               logger.error(f"Polling error: {str(e)}", exc_info=True)
-               time.sleep(10)
\ No newline at end of file
+import os
+import json
+import asyncio
+from aiohttp import web
+import redis.asyncio as redis
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+import logging
+import re
+import hashlib
+import random
+import functools
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields, asdict
+from enum import Enum
+from dotenv import load_dotenv
+import time
+from urllib.parse import urlparse
+from telebot import asyncio_helper, util
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+from logging_setup import setup_logging
+
+try:
+    import uvloop
+except ImportError:  # uvloop has no Windows build; fall back to the stock loop
+    uvloop = None
+
+# Load .env file
+load_dotenv()
+
+# Set up logging; ENV is read first since it picks the default level
+ENV = os.getenv('ENV', 'development')
+setup_logging(ENV)
+logger = logging.getLogger(__name__)
+
+# Environment variables
+TELEGRAM_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+REDIS_URL = os.getenv('REDIS_URL')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+PORT = int(os.getenv('PORT', '8443'))
+HEALTH_PORT = os.getenv('HEALTH_PORT')
+USE_POLLING = ENV == 'development' and not WEBHOOK_URL
+
+# Validate environment variables
+if not TELEGRAM_TOKEN:
+    logger.error("TELEGRAM_BOT_TOKEN not set")
+    raise ValueError("TELEGRAM_BOT_TOKEN not set")
+if not GEMINI_API_KEY:
+    logger.error("GEMINI_API_KEY not set")
+    raise ValueError("GEMINI_API_KEY not set")
+if ENV != 'development' and not WEBHOOK_URL:
+    logger.error("WEBHOOK_URL must be set outside development")
+    raise ValueError("WEBHOOK_URL must be set outside development")
+
+# run_webhooks adds a trailing slash to url_path and serves it as '/' + url_path;
+# Telegram won't follow the redirect from the bare path, so normalize to path/
+# once and register WEBHOOK_URL ending in exactly the /path/ the listener serves
+WEBHOOK_PATH = ''
+if WEBHOOK_URL:
+    webhook_parts = urlparse(WEBHOOK_URL)
+    WEBHOOK_PATH = webhook_parts.path.strip('/')
+    if not WEBHOOK_PATH:
+        logger.error("WEBHOOK_URL must include a path, e.g. https://example.com/telegram")
+        raise ValueError("WEBHOOK_URL must include a path, e.g. https://example.com/telegram")
+    WEBHOOK_PATH += '/'
+    WEBHOOK_URL = webhook_parts._replace(path='/' + WEBHOOK_PATH).geturl()
+
+# Updates Telegram may deliver to the webhook at once (its default is 40).
+# Each runs as its own task, so the listener can take the maximum.
+WEBHOOK_MAX_CONNECTIONS = 100
+
+# Every update runs as its own task, so a chat waiting on Gemini doesn't hold up
+# the others. Telegram calls share one keep-alive aiohttp session; size its pool
+# and give every call the same timeout instead of passing one per request.
+asyncio_helper.REQUEST_LIMIT = 64
+asyncio_helper.REQUEST_TIMEOUT = 60
+bot = AsyncTeleBot(TELEGRAM_TOKEN, parse_mode='Markdown')
+
+# Static instructions for idea generation; only the user profile varies per request
+IDEAS_INSTRUCTION = (
+    "Generate 3 concise side hustle ideas for the person described by the user's location, skills, budget and goals. "
+    "Each idea should be under 100 words, use bold Markdown (**Idea 1: Title**, **Idea 2: Title**, **Idea 3: Title**) for headings, "
+    "and include single newlines between ideas and paragraphs for readability. Avoid ### or other headers. Use only ASCII characters."
+)
+
+# Shared rules for follow-up answers; each prompt starts with the same profile block
+ADVICE_INSTRUCTION = (
+    "You advise Kenyan entrepreneurs on side hustles. The user's message starts with their location, skills, budget and goals. "
+    "Keep every answer under 150 words, use Markdown for readability, avoid ### headers, and use only ASCII characters."
+)
+
+# Rules for the one call that writes every idea's breakdown; the word cap is per breakdown
+DETAILS_INSTRUCTION = (
+    "You advise Kenyan entrepreneurs on side hustles. The user's message starts with their location, skills, budget and goals. "
+    "You will be asked for several breakdowns at once: keep each one under 150 words, use Markdown for readability, "
+    "avoid ### headers, and use only ASCII characters."
+)
+
+GEMINI_MODEL = 'gemini-2.5-flash'
+
+# Gemini setup
+try:
+    logger.info("Configuring Gemini API")
+    genai.configure(api_key=GEMINI_API_KEY)
+    model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=ADVICE_INSTRUCTION)
+    ideas_model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=IDEAS_INSTRUCTION)
+    details_model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=DETAILS_INSTRUCTION)
+    logger.info("Gemini API configured successfully")
+except Exception as e:
+    logger.error("Gemini initialization error: %s", e, exc_info=True)
+    raise
+
+# Conversation states
+class State(Enum):
+    SKILLS = 1
+    LOCATION = 2
+    BUDGET = 3
+    GOALS = 4
+    ASK_QUESTION = 5
+    EXPLORE_IDEA = 6
+    CUSTOM_IDEA = 7
+
+@dataclass(slots=True)
+class Session:
+    """One user's answers and progress through the conversation."""
+    state: State = State.SKILLS
+    skills: str = ''
+    location: str = ''
+    # KES, parsed once when the user answers
+    budget: int = 0
+    goals: str = ''
+    question: str = ''
+    custom_idea: str = ''
+    idea_headings: list = field(default_factory=list)
+    # Bit i-1 is set once idea i has been explored
+    explored_mask: int = 0
+    # Goals mention 30,000 or 50,000; decides the coaching upsell at the end
+    is_high_goal: bool = False
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after ttl seconds."""
+
+    def __init__(self, maxsize=4096, ttl=86400):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (ttl or self.ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key, ttl=None):
+        """Increment a counter that resets ttl seconds after its first hit."""
+        with self._lock:
+            now = time.monotonic()
+            item = self._data.get(key)
+            if item is None or item[1] < now:
+                item = (0, now + (ttl or self.ttl))
+            count = item[0] + 1
+            self._data[key] = (count, item[1])
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return count
+
+class StateStore:
+    """Per-user conversation state, kept in Redis when REDIS_URL is set.
+
+    In Redis each session is a hash at forge:session:{user_id}, one field
+    per Session attribute, expiring after ttl seconds. Without Redis, state
+    lives in a process-local TTLCache so abandoned sessions still expire.
+    Callers must set() after changing a session.
+    """
+
+    def __init__(self, redis_client=None, ttl=3600):
+        self.ttl = ttl
+        self._redis = redis_client
+        self._local = TTLCache(maxsize=100000, ttl=ttl)
+        self._local_counters = TTLCache(maxsize=100000, ttl=60)
+
+    @staticmethod
+    def _key(user_id):
+        return f"forge:session:{user_id}"
+
+    @staticmethod
+    def _encode(data):
+        """Flatten a Session into Redis hash fields."""
+        mapping = asdict(data)
+        mapping['state'] = data.state.name
+        for k, v in mapping.items():
+            if isinstance(v, list):
+                mapping[k] = json.dumps(v)
+            elif isinstance(v, bool):
+                mapping[k] = int(v)
+        return mapping
+
+    @staticmethod
+    def _decode(mapping):
+        """Rebuild a Session from Redis hash fields, ignoring unknown ones."""
+        kwargs = {}
+        for f in fields(Session):
+            if f.name not in mapping:
+                continue
+            value = mapping[f.name]
+            if f.name == 'state':
+                # Sessions written before states were stored by name hold the number
+                value = State(int(value)) if value.isdigit() else State[value]
+            elif f.type is list:
+                value = json.loads(value)
+            elif f.type is int:
+                # Sessions saved before budget was an int hold '' or free text
+                value = int(value) if value.isdigit() else 0
+            elif f.type is bool:
+                value = value == '1'
+            kwargs[f.name] = value
+        session = Session(**kwargs)
+        if session.state.value > State.BUDGET.value and session.budget <= 0:
+            # Budget unreadable from an old session: ask for it again
+            session.state = State.BUDGET
+        return session
+
+    async def get(self, user_id):
+        if self._redis is None:
+            return self._local.get(user_id)
+        mapping = await self._redis.hgetall(self._key(user_id))
+        if not mapping:
+            return None
+        return self._decode(mapping)
+
+    async def set(self, user_id, data, ttl=None):
+        ttl = ttl or self.ttl
+        if self._redis is None:
+            self._local.set(user_id, data, ttl=ttl)
+        else:
+            key = self._key(user_id)
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping=self._encode(data))
+                pipe.expire(key, ttl)
+                await pipe.execute()
+
+    async def pop(self, user_id):
+        if self._redis is None:
+            self._local.pop(user_id)
+        else:
+            await self._redis.delete(self._key(user_id))
+
+    async def hit(self, user_id, window):
+        """Count a request in the user's current window and return the window total."""
+        if self._redis is None:
+            return self._local_counters.incr(user_id, ttl=window)
+        key = f"forge:rl:{user_id}"
+        # Create the counter with its expiry and count in one transaction, so
+        # it can't be left without a TTL if the process dies in between
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.set(key, 0, nx=True, ex=window)
+            pipe.incr(key)
+            _, count = await pipe.execute()
+        return count
+
+class ResponseCache:
+    """Cleaned Gemini replies shared across users, kept in Redis when REDIS_URL is set.
+
+    Keys may be any string or tuple; in Redis they are stored as
+    {prefix}:{sha1(key)} and expire after ttl seconds. Without Redis, replies
+    live in a process-local TTLCache.
+
+    get_or_claim() lets one caller generate a missing reply while others
+    with the same key wait for it; a caller that got the claim must
+    release() it when done. A held claim is refreshed every claim_ttl / 3
+    seconds however long generation takes, so claim_ttl only bounds how long
+    a claimer that died keeps others waiting.
+    """
+
+    def __init__(self, redis_client=None, prefix='gemini', ttl=21600, claim_ttl=35):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.claim_ttl = claim_ttl
+        self._redis = redis_client
+        self._local = TTLCache(maxsize=4096, ttl=ttl)
+        self._local_claims = TTLCache(maxsize=4096, ttl=claim_ttl)
+        self._refreshers = {}
+
+    def _key(self, key):
+        return f"{self.prefix}:{hashlib.sha1(str(key).encode()).hexdigest()}"
+
+    def _claim_key(self, key):
+        return f"{self.prefix}:lock:{hashlib.sha1(str(key).encode()).hexdigest()}"
+
+    async def _claim(self, key):
+        if self._redis is None:
+            if self._local_claims.get(key) is not None:
+                return False
+            self._local_claims.set(key, True)
+            return True
+        try:
+            return bool(await self._redis.set(self._claim_key(key), 1, nx=True, ex=self.claim_ttl))
+        except redis.RedisError as e:
+            logger.warning("Reply cache claim failed: %s", e)
+            return True
+
+    async def _refresh_claim(self, key):
+        """Keep the claim on key alive until release() cancels this task."""
+        while True:
+            await asyncio.sleep(self.claim_ttl / 3)
+            if self._redis is None:
+                self._local_claims.set(key, True)
+                continue
+            try:
+                await self._redis.expire(self._claim_key(key), self.claim_ttl)
+            except redis.RedisError as e:
+                logger.warning("Reply cache claim refresh failed: %s", e)
+
+    async def get_or_claim(self, key, wait=120):
+        """Return (reply, claimed) for key.
+
+        reply is the cached text, or None if the caller should generate it;
+        claimed says whether the caller now holds the claim. While another
+        caller holds it, poll for its reply for up to wait seconds (long enough
+        for a streamed reply and its retries), then give up and generate
+        without the claim rather than take over someone else's.
+        """
+        text = await self.get(key)
+        deadline = time.monotonic() + wait
+        while text is None:
+            if await self._claim(key):
+                previous = self._refreshers.pop(key, None)
+                if previous is not None:
+                    previous.cancel()
+                self._refreshers[key] = asyncio.create_task(self._refresh_claim(key))
+                return None, True
+            if time.monotonic() >= deadline:
+                return None, False
+            await asyncio.sleep(0.25)
+            text = await self.get(key)
+        return text, False
+
+    async def release(self, key):
+        """Drop the claim taken by get_or_claim(), whether or not a reply was stored."""
+        refresher = self._refreshers.pop(key, None)
+        if refresher is not None:
+            refresher.cancel()
+        if self._redis is None:
+            self._local_claims.pop(key)
+            return
+        try:
+            await self._redis.delete(self._claim_key(key))
+        except redis.RedisError as e:
+            logger.warning("Reply cache release failed: %s", e)
+
+    async def get(self, key):
+        if self._redis is None:
+            return self._local.get(key)
+        try:
+            return await self._redis.get(self._key(key))
+        except redis.RedisError as e:
+            logger.warning("Reply cache read failed: %s", e)
+            return None
+
+    async def set(self, key, text):
+        if self._redis is None:
+            self._local.set(key, text)
+            return
+        try:
+            await self._redis.set(self._key(key), text, ex=self.ttl)
+        except redis.RedisError as e:
+            logger.warning("Reply cache write failed: %s", e)
+
+class TokenBucket:
+    """Async token bucket allowing rate acquisitions per second, bursting to capacity.
+
+    Waiters are served in arrival order, so a bucket doubles as a FIFO queue.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Hold every acquire() for the next seconds."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+# One capped connection pool shared by sessions and the reply caches
+redis_client = None
+if REDIS_URL:
+    redis_client = redis.Redis(connection_pool=redis.ConnectionPool.from_url(REDIS_URL, max_connections=50, decode_responses=True))
+
+# Store user data
+user_data = StateStore(redis_client)
+
+# Gemini requests allowed per user per window (seconds)
+RATE_LIMIT = 5
+RATE_WINDOW = 60
+RATE_LIMITED_MESSAGE = "You're going too fast — try again in a minute."
+
+# Telegram's send limits: about 30 messages/s per bot and 1/s per chat
+telegram_bucket = TokenBucket(rate=30, capacity=30)
+chat_buckets = TTLCache(maxsize=10000, ttl=60)
+CHAT_RATE = 1
+CHAT_BURST = 3
+
+# Telegram error codes that mean the request itself is wrong, so retrying can't help
+NON_RETRYABLE_CODES = {400, 401, 403, 404}
+
+# Bot-wide sends per second across all workers when Redis is shared; kept
+# under Telegram's 30 for headroom
+GLOBAL_SEND_LIMIT = 28
+
+# Gemini calls in flight at once across all chats; the rest queue for a slot
+GEMINI_CONCURRENCY = 32
+gemini_slots = asyncio.Semaphore(GEMINI_CONCURRENCY)
+
+# Longest user reply passed on to Gemini
+MAX_INPUT_CHARS = 300
+
+# Shown while Gemini works, then overwritten with the reply
+GENERATING_MESSAGE = "Generating... ⏳"
+
+# Longest text sent as one message, under Telegram's 4096 for headroom
+MAX_MESSAGE_CHARS = 4000
+
+# While streaming, edit the reply in place at most this often (seconds), and
+# start a new message once the current one holds this many characters
+STREAM_EDIT_INTERVAL = 1.5
+STREAM_MESSAGE_CHARS = 3500
+
+# Keyboards that never change, built once
+WELCOME_KB = InlineKeyboardMarkup()
+WELCOME_KB.add(InlineKeyboardButton("Start Now 🚀", callback_data="start_new"))
+WELCOME_KB.add(InlineKeyboardButton("Learn More 🌐", callback_data="learn_more"))
+
+ASK_Q_BTN = InlineKeyboardButton("Ask a Question ❓", callback_data="ask_question")
+ASK_AGAIN_BTN = InlineKeyboardButton("Ask Another Question ❓", callback_data="ask_question")
+CUSTOM_IDEA_BTN = InlineKeyboardButton("Have Your Own Idea? 💡", callback_data="custom_idea")
+CLOSE_BTN = InlineKeyboardButton("Close Conversation 🛑", callback_data="end_conversation")
+
+NEXT_STEP_KB = InlineKeyboardMarkup()
+NEXT_STEP_KB.add(ASK_Q_BTN)
+NEXT_STEP_KB.add(CLOSE_BTN)
+
+END_CONV_KB = InlineKeyboardMarkup()
+END_CONV_KB.add(InlineKeyboardButton("Full Strategy (KES 500) 💼", callback_data="premium_strategy"))
+END_CONV_KB.add(InlineKeyboardButton("Talk to an Expert 🌐", callback_data="talk_expert"))
+END_CONV_KB.add(InlineKeyboardButton("End Conversation 🛑", callback_data="final_end"))
+END_CONV_KB.add(InlineKeyboardButton("Share with Friends 📣", callback_data="share_friends"))
+
+def cache_prefix(kind, instruction):
+    """Namespace cached replies by model and instruction, so changing either starts a fresh cache."""
+    version = hashlib.sha1(f"{GEMINI_MODEL}\n{instruction}".encode()).hexdigest()[:8]
+    return f"gemini:{kind}:{version}"
+
+# Generated ideas keyed by their prompt, which describe_profile() normalizes
+ideas_cache = ResponseCache(redis_client, prefix=cache_prefix('ideas', IDEAS_INSTRUCTION), ttl=86400)
+
+# Answers to questions keyed by question_key()
+answers_cache = ResponseCache(redis_client, prefix=cache_prefix('answers', ADVICE_INSTRUCTION))
+
+# Idea breakdowns keyed by prompt, whether prefetched (details_model) or
+# generated on click (model), so both instructions version the prefix
+details_cache = ResponseCache(
+    redis_client, prefix=cache_prefix('details', DETAILS_INSTRUCTION + ADVICE_INSTRUCTION), ttl=86400
+)
+
+# Idea breakdowns generated before the user asks for them, keyed by prompt.
+# Values are (task, index) into one batch so a click that lands mid-generation
+# can await the result.
+idea_details_cache = TTLCache(maxsize=4096, ttl=1800)
+
+# Nobody is watching a prefetch, so give it longer than interactive calls before giving up
+PREFETCH_TIMEOUT = 60
+
+def iter_telegram_chunks(text, max_length=MAX_MESSAGE_CHARS):
+    """Yield slices of text no longer than max_length, cutting at paragraph, line or word breaks."""
+    start = 0
+    end = len(text)
+    while end - start > max_length:
+        limit = start + max_length
+        cut = text.rfind('\n\n', start, limit)
+        sep = 2
+        if cut <= start:
+            cut = text.rfind('\n', start, limit)
+            sep = 1
+        if cut <= start:
+            cut = text.rfind(' ', start, limit)
+        if cut <= start:
+            # No break of any kind to cut at; split mid-word
+            yield text[start:limit]
+            start = limit
+            continue
+        yield text[start:cut]
+        start = cut + sep
+    if start < end:
+        yield text[start:]
+
+# Text patterns, compiled once
+_HEADER_RE = re.compile(r'#+ \d+\.\s*([^\n]+)')
+_MD_FIX_RE = re.compile(r'([*_]{1,2})([^\s*_])')
+_NON_ASCII_RE = re.compile(r'[^\x00-\x7F]+')
+_LINE_BREAK_RE = re.compile(r'\s*\n\s*')
+_HEADING_RE = re.compile(r'^\*\*(.+?)\*\*', re.MULTILINE)
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_HIGH_GOAL_RE = re.compile(r'[35]0,?000')
+_CTRL_RE = re.compile(r'[\x00-\x08\x0b-\x1f\x7f]')
+_BUDGET_RE = re.compile(r'(?<!\d)\d{3,8}(?!\d)')
+_DIGIT_GROUP_RE = re.compile(r"(?<=\d)[\s.,'](?=\d{3}(?!\d))")
+_QUICK_SPLIT_RE = re.compile(r'\s*;\s*')
+_BREAKDOWN_SPLIT_RE = re.compile(r'^=== Idea \d+ ===$', re.MULTILINE)
+
+def clean_response(text):
+    """Clean Gemini response to ensure valid Markdown and avoid parse errors."""
+    # Replace ### with bold and ensure proper Markdown
+    text = _HEADER_RE.sub(r'**\1**', text)
+    # Fix unbalanced Markdown characters
+    text = _MD_FIX_RE.sub(r'\1 \2', text)
+    # Remove problematic characters
+    # Remove non-ASCII characters; replies are usually pure ASCII already, and
+    # isascii() answers that in one C pass without starting the regex engine
+    if not text.isascii():
+        text = _NON_ASCII_RE.sub(' ', text)
+    # Strip every line and drop blank ones in a single pass
+    return _LINE_BREAK_RE.sub('\n', text.strip())
+
+def clean_url(url):
+    """Ensure URL is valid for Telegram's Markdown parser."""
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    return url
+
+def extract_idea_headings(text):
+    """Extract idea headings from Gemini response."""
+    return [heading.strip() for heading in _HEADING_RE.findall(text)[:3]]  # Limit to 3 ideas
+
+def sanitize(text, max_len=MAX_INPUT_CHARS):
+    """Drop control characters and cap user input before it reaches a prompt."""
+    return _CTRL_RE.sub('', text)[:max_len].strip()
+
+def normalize_text(text):
+    """Lower-case and collapse whitespace so equivalent answers compare equal."""
+    return ' '.join(text.lower().split())
+
+def parse_budget(text):
+    """Read a KES amount, allowing digit grouping like 5,000, 5 000 or 5'000.
+
+    Returns None unless exactly one positive amount is found, so replies
+    such as "between 5000 and 10000" get the question asked again.
+    """
+    amounts = _BUDGET_RE.findall(_DIGIT_GROUP_RE.sub('', text))
+    if len(amounts) != 1 or int(amounts[0]) <= 0:
+        return None
+    return int(amounts[0])
+
+def budget_bucket(budget, step=1000):
+    """Round a KES budget to the nearest step."""
+    return budget if budget < step else round(budget / step) * step
+
+def question_key(data, question):
+    """Key answers so the same question from a similar profile hits the cache."""
+    return (
+        normalize_text(data.location),
+        normalize_text(data.skills),
+        budget_bucket(data.budget, step=5000),
+        normalize_text(_PUNCT_RE.sub(' ', question)),
+    )
+
+def describe_profile(data):
+    """Describe the user's saved answers as the opening block of a prompt.
+
+    Answers are normalized and the budget bucketed, so equivalent profiles
+    build identical prompts and share cached replies.
+    """
+    return (
+        f"Location: {normalize_text(data.location)}\nSkills: {normalize_text(data.skills)}\n"
+        f"Budget: {budget_bucket(data.budget)} KES\nGoals: {normalize_text(data.goals)}"
+    )
+
+def breakdowns_prompt(data):
+    """Build one prompt asking for every idea's breakdown, each under a '=== Idea N ===' line."""
+    ideas = '\n'.join(f"{i}. {heading}" for i, heading in enumerate(data.idea_headings, 1))
+    return (
+        f"{describe_profile(data)}\n\n"
+        f"Provide a detailed breakdown for each of these side hustle ideas for this person:\n{ideas}\n"
+        f"For each, include steps to start, potential challenges, and how to use the budget. "
+        f"Start each breakdown with a line reading '=== Idea N ===' where N is its number, "
+        f"and keep each breakdown under 150 words."
+    )
+
+def explore_prompt(heading, data):
+    """Build the prompt for a detailed breakdown of one idea."""
+    return (
+        f"{describe_profile(data)}\n\n"
+        f"Provide a detailed breakdown for the side hustle idea '{heading}' for this person. "
+        f"Include steps to start, potential challenges, and how to use the budget."
+    )
+
+# Failures from Telegram, the network or Gemini that are explained by their message alone
+EXPECTED_ERRORS = (
+    asyncio_helper.ApiException,
+    asyncio_helper.RequestTimeout,
+    google_exceptions.GoogleAPIError,
+)
+
+def log_failure(message, error):
+    """Log a handler failure, formatting a traceback only for unexpected errors."""
+    if isinstance(error, EXPECTED_ERRORS):
+        logger.warning(message, error)
+    else:
+        logger.error(message, error, exc_info=error)
+
+async def check_rate_limit(user_id, limit=RATE_LIMIT, window=RATE_WINDOW):
+    """Return True if the user may make another Gemini request in this window."""
+    return await user_data.hit(user_id, window) <= limit
+
+def retry_after_seconds(error):
+    """Return the wait Telegram asked for in a 429 response, if any."""
+    if isinstance(error, asyncio_helper.ApiTelegramException):
+        return (error.result_json.get('parameters') or {}).get('retry_after')
+    return None
+
+def chat_bucket(chat_id):
+    """Return the send bucket for a chat, creating it on first use.
+
+    The bucket is stored again on every use so it expires ttl seconds after
+    the chat's last send, not its first; a busy chat never gets a fresh,
+    full bucket mid-conversation.
+    """
+    bucket = chat_buckets.get(chat_id)
+    if bucket is None:
+        bucket = TokenBucket(rate=CHAT_RATE, capacity=CHAT_BURST)
+    chat_buckets.set(chat_id, bucket)
+    return bucket
+
+async def acquire_global_send():
+    """Wait for a send slot in the current second, counted across every worker via Redis.
+
+    Without Redis each process relies on telegram_bucket alone. If Redis
+    fails the send goes ahead rather than being held up.
+    """
+    if redis_client is None:
+        return
+    while True:
+        now = time.time()
+        key = f"forge:rl:global:{int(now)}"
+        try:
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.incr(key)
+                pipe.expire(key, 2)
+                count, _ = await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Shared send limit unavailable: %s", e)
+            return
+        if count <= GLOBAL_SEND_LIMIT:
+            return
+        await asyncio.sleep(1 - now % 1)
+
+async def retry_send_message(func, chat_id, *args, retries=3, delay=10, **kwargs):
+    """Send to chat_id within Telegram's rate limits, retrying with jittered exponential backoff.
+
+    Sends go through the chat's bucket, this process's bot-wide bucket and,
+    with Redis, the bot-wide limit shared by all workers. When Telegram
+    answers 429 with retry_after, both local buckets are paused for exactly
+    that long instead. Errors in NON_RETRYABLE_CODES (bad request, blocked
+    by the user, ...) are raised at once.
+    """
+    bucket = chat_bucket(chat_id)
+    for attempt in range(retries):
+        try:
+            await bucket.acquire()
+            await telegram_bucket.acquire()
+            await acquire_global_send()
+            return await func(chat_id, *args, **kwargs)
+        # telebot wraps aiohttp failures in these, so they are all it raises
+        except (asyncio_helper.ApiException, asyncio_helper.RequestTimeout) as e:
+            if getattr(e, 'error_code', None) in NON_RETRYABLE_CODES:
+                logger.error("Telegram rejected the request: %s", e)
+                raise
+            logger.warning("Attempt %s/%s failed: %s", attempt + 1, retries, e)
+            if attempt == retries - 1:
+                logger.error("Failed after %s attempts: %s", retries, e)
+                raise
+            retry_after = retry_after_seconds(e)
+            if retry_after is not None:
+                telegram_bucket.pause(retry_after)
+                bucket.pause(retry_after)
+                continue
+            await asyncio.sleep(delay * (2 ** attempt) + random.uniform(0, 1))
+
+async def edit_text(chat_id, message_id, text, **kwargs):
+    """Replace a message's text; takes chat_id first to suit retry_send_message."""
+    try:
+        return await bot.edit_message_text(text, chat_id, message_id, **kwargs)
+    except asyncio_helper.ApiTelegramException as e:
+        # Re-sending the text a message already shows is not worth retrying
+        if 'message is not modified' in e.description:
+            return None
+        raise
+
+async def send_long_message(chat_id, text, reply_markup=None, edit_message_id=None, silent=False):
+    """Send text in Telegram-sized parts, attaching reply_markup to the last part.
+
+    With edit_message_id, the first part is written into that message instead
+    of being sent as a new one. With silent, the first part doesn't notify
+    either, for text continuing a reply the user was already notified of.
+    """
+    # Nearly every reply fits in one message; skip the chunker for those
+    messages = [text] if len(text) <= MAX_MESSAGE_CHARS else list(iter_telegram_chunks(text))
+    if len(messages) > 1:
+        logger.debug("Sending reply to %s in %s parts", chat_id, len(messages))
+    for i, msg in enumerate(messages, 1):
+        markup = reply_markup if i == len(messages) else None
+        if i == 1 and edit_message_id is not None:
+            await retry_send_message(edit_text, chat_id, edit_message_id, msg, reply_markup=markup)
+        else:
+            # Only the first part of a reply should buzz the user's phone
+            await retry_send_message(
+                bot.send_message, chat_id, msg, reply_markup=markup, disable_notification=silent or i > 1
+            )
+
+async def show_text(chat_id, message_id, text, **kwargs):
+    """Write text into message_id, or send it as a new message when there is none.
+
+    A new message continues a streamed reply, so it goes out without a
+    notification. Returns the id of the message now showing text.
+    """
+    if message_id is None:
+        message = await retry_send_message(bot.send_message, chat_id, text, disable_notification=True, **kwargs)
+        return message.message_id
+    await retry_send_message(edit_text, chat_id, message_id, text, **kwargs)
+    return message_id
+
+# Gemini errors that usually clear up after a short pause
+RETRYABLE_GEMINI_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable)
+
+async def gemini_with_retry(gen_model, prompt, tries=3, **kwargs):
+    """Start a Gemini request, retrying quota and availability errors with jittered backoff."""
+    for attempt in range(tries):
+        try:
+            return await gen_model.generate_content_async(prompt, **kwargs)
+        except RETRYABLE_GEMINI_ERRORS as e:
+            if attempt == tries - 1:
+                raise
+            logger.warning("Gemini attempt %s/%s failed: %s", attempt + 1, tries, e)
+            await asyncio.sleep(2 ** attempt + random.uniform(0, 0.5))
+
+async def stream_reply(chat_id, gen_model, prompt, footer, build_markup, header=''):
+    """Stream a Gemini reply to the chat as it is generated and return the cleaned text.
+
+    A placeholder goes out immediately and is edited with the reply as it
+    arrives, at most every STREAM_EDIT_INTERVAL seconds. One of the
+    gemini_slots is held until the stream ends. In-progress edits are plain
+    text so half-written Markdown can't be rejected. Once a message holds
+    STREAM_MESSAGE_CHARS it is closed at a paragraph break and the rest
+    continues in a new message. The last one gets footer and the keyboard
+    returned by build_markup(full_text).
+    """
+    placeholder = await retry_send_message(bot.send_message, chat_id, GENERATING_MESSAGE)
+    message_id = placeholder.message_id
+    parts = []
+    pending = ''
+    shown = ''
+    last_edit = time.monotonic()
+    async with gemini_slots:
+        response = await gemini_with_retry(gen_model, prompt, stream=True, request_options={"timeout": 30})
+        async for chunk in response:
+            if not chunk.parts:
+                continue
+            pending += chunk.text
+            prefix = '' if parts else header
+            if len(pending) >= STREAM_MESSAGE_CHARS:
+                cut = pending.rfind('\n\n', 0, STREAM_MESSAGE_CHARS)
+                if cut <= 0:
+                    cut = pending.rfind('\n', 0, STREAM_MESSAGE_CHARS)
+                if cut <= 0:
+                    cut = STREAM_MESSAGE_CHARS
+                part = clean_response(pending[:cut])
+                pending = pending[cut:]
+                if part:
+                    await show_text(chat_id, message_id, f"{prefix}{part}")
+                    parts.append(part)
+                    message_id = None
+                    shown = ''
+                    continue
+            if time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+                text = clean_response(pending)
+                if text and text != shown:
+                    try:
+                        message_id = await show_text(chat_id, message_id, f"{prefix}{text}", parse_mode='', retries=1)
+                        shown = text
+                    except Exception as e:
+                        logger.debug("Skipped streaming edit: %s", e)
+                    last_edit = time.monotonic()
+    tail = clean_response(pending)
+    if tail:
+        parts.append(tail)
+    if not parts:
+        raise ValueError("Empty response from Gemini")
+    full_text = '\n'.join(parts)
+    last = f"{tail}\n\n{footer}" if tail else footer
+    if len(parts) == 1 and tail:
+        last = f"{header}{last}"
+    # message_id is None once the reply has overflowed into a later message
+    await send_long_message(
+        chat_id, last, reply_markup=build_markup(full_text), edit_message_id=message_id, silent=message_id is None
+    )
+    return full_text
+
+def ideas_keyboard(text):
+    """Build the explore buttons for the ideas in a Gemini reply."""
+    keyboard = InlineKeyboardMarkup()
+    for i, heading in enumerate(extract_idea_headings(text), 1):
+        keyboard.add(InlineKeyboardButton(f"{heading} 🌟", callback_data=f"explore_idea_{i}"))
+    return keyboard
+
+async def generate_text(gen_model, prompt, timeout=30):
+    """Generate a complete Gemini reply and return it cleaned."""
+    async with gemini_slots:
+        response = await gemini_with_retry(gen_model, prompt, request_options={"timeout": timeout})
+    text = clean_response(response.text)
+    if not text:
+        raise ValueError("Empty response from Gemini")
+    return text
+
+async def generate_idea_details(prompts, batch_prompt):
+    """Generate every idea breakdown in one Gemini call and cache each under its explore prompt."""
+    cached = [await details_cache.get(prompt) for prompt in prompts]
+    if None not in cached:
+        return cached
+    text = await generate_text(details_model, batch_prompt, timeout=PREFETCH_TIMEOUT)
+    parts = [part.strip() for part in _BREAKDOWN_SPLIT_RE.split(text)[1:]]
+    if len(parts) != len(prompts) or not all(parts):
+        raise ValueError(f"Expected {len(prompts)} breakdowns from Gemini, got {len(parts)}")
+    for prompt, part in zip(prompts, parts):
+        await details_cache.set(prompt, part)
+    return parts
+
+def _log_prefetch_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Idea prefetch failed: %s", task.exception())
+
+def prefetch_idea_details(data):
+    """Start generating every idea breakdown in one call so explore clicks answer instantly."""
+    prompts = [explore_prompt(heading, data) for heading in data.idea_headings]
+    if not prompts or idea_details_cache.get(prompts[0]) is not None:
+        return
+    task = asyncio.create_task(generate_idea_details(prompts, breakdowns_prompt(data)))
+    task.add_done_callback(_log_prefetch_error)
+    for i, prompt in enumerate(prompts):
+        idea_details_cache.set(prompt, (task, i))
+
+async def prefetched_text(prompt):
+    """Return a prefetched or cached breakdown for prompt, or None if there is none to use."""
+    entry = idea_details_cache.get(prompt)
+    if entry is None:
+        return await details_cache.get(prompt)
+    task, index = entry
+    try:
+        return (await asyncio.shield(task))[index]
+    except Exception:
+        idea_details_cache.pop(prompt)
+        return None
+
+def ideas_left(headings, explored_mask):
+    """Return True while at least one idea hasn't been explored."""
+    return explored_mask != (1 << len(headings)) - 1
+
+def build_next_keyboard(headings, explored_mask, ask_button=ASK_Q_BTN):
+    """Build the follow-up keyboard: ask, explore each remaining idea, or close."""
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(ask_button)
+    for i, heading in enumerate(headings, 1):
+        if not explored_mask & (1 << (i - 1)):
+            keyboard.add(InlineKeyboardButton(f"Explore {heading} 🌟", callback_data=f"explore_idea_{i}"))
+    if not ideas_left(headings, explored_mask):
+        keyboard.add(CUSTOM_IDEA_BTN)
+    keyboard.add(CLOSE_BTN)
+    return keyboard
+
+async def send_ideas(chat_id, data):
+    """Send side hustle ideas for a profile, reusing recent answers for equivalent profiles."""
+    header = "Here are your side hustle ideas:\n"
+    footer = "Choose your best idea to explore further:"
+    prompt = describe_profile(data)
+    cached, claimed = await ideas_cache.get_or_claim(prompt)
+    if cached is not None:
+        logger.info("Serving ideas from cache")
+        await send_long_message(chat_id, f"{header}{cached}\n\n{footer}", reply_markup=ideas_keyboard(cached))
+        return cached
+    logger.debug("Sending prompt to Gemini: %s", prompt)
+    try:
+        cleaned_response = await stream_reply(chat_id, ideas_model, prompt, footer, ideas_keyboard, header=header)
+        await ideas_cache.set(prompt, cleaned_response)
+    finally:
+        if claimed:
+            await ideas_cache.release(prompt)
+    return cleaned_response
+
+WEBSITE_URL = clean_url('https://www.linkedin.com/in/mwaura-wambiru')
+UPSELL_TEXT = "To hit big goals like yours, our Expert Hustle Coach can help!"
+
+async def present_ideas(message, data):
+    """Send ideas for a completed profile and ready the session for exploring them.
+
+    Returns False once the user has been told and the session dropped if
+    Gemini fails; the caller must still save data on success.
+    """
+    data.is_high_goal = bool(_HIGH_GOAL_RE.search(data.goals))
+    try:
+        cleaned_response = await send_ideas(message.chat.id, data)
+        logger.debug("Gemini response: %s", cleaned_response)
+        data.idea_headings = extract_idea_headings(cleaned_response)
+        prefetch_idea_details(data)
+    except Exception as e:
+        log_failure("Gemini error: %s", e)
+        await retry_send_message(
+            bot.send_message,
+            message.chat.id,
+            "Sorry, I couldn't generate ideas right now. Try again or use /cancel."
+        )
+        await user_data.pop(message.from_user.id)
+        return False
+    data.state = State.EXPLORE_IDEA
+    data.explored_mask = 0
+    return True
+
+# Callback buttons whose reply never depends on the user: callback data -> (text, keyboard)
+STATIC_CALLBACK_REPLIES = {
+    "learn_more": (
+        f"Discover more at our website: {WEBSITE_URL} (explore our expert plans!)",
+        None
+    ),
+    "premium_strategy": (
+        "For a full strategy with Expert Hustle Coach guidance (KES 500), pay via M-Pesa to 0721494836. Send receipt to start.",
+        None
+    ),
+    "talk_expert": (
+        f"Connect with our Expert Hustle Coach at {WEBSITE_URL} to unlock personalized guidance!",
+        None
+    ),
+    "final_end": (
+        "Thanks for using AnzaBiz AI! Start again anytime with /start. 😊",
+        None
+    ),
+    "share_friends": (
+        f"Share AnzaBiz AI with friends! Invite 3 friends to @AnzaBiz_bot and get a free KES 100 summary. Visit {WEBSITE_URL} for details.",
+        None
+    ),
+}
+
+# Fire-and-forget tasks, referenced here until they finish so they can't be collected
+background_tasks = set()
+
+def _on_answer_done(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug("Couldn't answer callback query: %s", task.exception())
+
+def acknowledge_callback(handler):
+    """Answer the callback query alongside handler so the button stops spinning at once.
+
+    The answer doesn't wait for handler, or for the user's earlier updates.
+    """
+    @functools.wraps(handler)
+    async def wrapper(call):
+        task = asyncio.create_task(bot.answer_callback_query(call.id))
+        background_tasks.add(task)
+        task.add_done_callback(_on_answer_done)
+        return await handler(call)
+    return wrapper
+
+# Per-user [lock, holders]; an entry is dropped once nobody holds or waits on it
+_user_locks = {}
+
+def one_update_per_user(handler):
+    """Run handler for one of a user's updates at a time, in arrival order.
+
+    Each update already runs as its own task, so other users are never held
+    up. Serializing a user's own updates stops a double tap or a click during
+    a long reply from loading the same session twice and losing one write.
+    """
+    @functools.wraps(handler)
+    async def wrapper(update):
+        user_id = update.from_user.id
+        entry = _user_locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await handler(update)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del _user_locks[user_id]
+    return wrapper
+
+@bot.message_handler(commands=['start'])
+async def start(message):
+    logger.info("Received /start command from user %s", message.from_user.id)
+    try:
+        await user_data.pop(message.from_user.id)
+        await retry_send_message(
+            bot.send_message,
+            message.chat.id,
+            "Welcome to AnzaBiz AI! Let's find you some awesome side hustle ideas in Kenya. 😊\n\nFirst, tell me: What skills do you have? (e.g., cooking, phone repair, graphic design)"
+        )
+        await bot.set_chat_menu_button(message.chat.id, None)
+        await user_data.set(message.from_user.id, Session())
+        logger.info("Sent welcome message")
+    except Exception as e:
+        log_failure("Error in start handler: %s", e)
+        await retry_send_message(bot.send_message, message.chat.id, "Sorry, something went wrong. Please try again.")
+
+@bot.message_handler(commands=['cancel'])
+async def cancel(message):
+    logger.info("Received /cancel command from user %s", message.from_user.id)
+    try:
+        await user_data.pop(message.from_user.id)
+        await retry_send_message(bot.send_message, message.chat.id, "Conversation cancelled.")
+        logger.info("Conversation cancelled")
+    except Exception as e:
+        log_failure("Error in cancel handler: %s", e)
+        await retry_send_message(bot.send_message, message.chat.id, "Sorry, something went wrong. Please try again.")
+
+@bot.message_handler(commands=['quick'])
+@one_update_per_user
+async def quick(message):
+    """Take all four answers in one message: /quick skills; location; budget; goals."""
+    user_id = message.from_user.id
+    logger.info("Received /quick command from user %s", user_id)
+    try:
+        answers = [sanitize(part) for part in _QUICK_SPLIT_RE.split(util.extract_arguments(message.text), maxsplit=3)]
+        budget = parse_budget(answers[2]) if len(answers) == 4 else None
+        if budget is None or not all(answers):
+            await retry_send_message(
+                bot.send_message,
+                message.chat.id,
+                "Send all four answers separated by semicolons, e.g.\n"
+                "/quick cooking; Nairobi; 5000; earn 20000/month"
+            )
+            return
+        if not await check_rate_limit(user_id):
+            await retry_send_message(bot.send_message, message.chat.id, RATE_LIMITED_MESSAGE)
+            return
+        skills, location, _, goals = answers
+        data = Session(skills=skills, location=location, budget=budget, goals=goals)
+        if await present_ideas(message, data):
+            await user_data.set(user_id, data)
+    except Exception as e:
+        log_failure("Error in quick handler: %s", e)
+        await retry_send_message(bot.send_message, message.chat.id, "Sorry, something went wrong. Please try again.")
+
+@bot.message_handler(func=lambda message: True)
+@one_update_per_user
+async def handle_message(message):
+    user_id = message.from_user.id
+    logger.debug("Processing message from %s: %s", user_id, message.text)
+    
+    # Handle commands separately
+    if message.text.startswith('/'):
+        if message.text not in ['/start', '/cancel']:
+            await retry_send_message(
+                bot.send_message,
+                message.chat.id,
+                "Please enter the requested information (e.g., skills, location) or use /start to begin, /cancel to reset."
+            )
+        return
+
+    # Initialize user data if not present
+    data = await user_data.get(user_id)
+    if data is None:
+        await retry_send_message(
+            bot.send_message,
+            message.chat.id,
+            "Hey there! I’m AnzaBiz AI, your side hustle guru in Kenya! 😎 Ready to find ideas that match your skills?",
+            reply_markup=WELCOME_KB
+        )
+        return
+
+    text = sanitize(message.text)
+    if not text:
+        await retry_send_message(bot.send_message, message.chat.id, "Please type your answer, or use /cancel to reset.")
+        return
+
+    state = data.state
+    try:
+        if state == State.SKILLS:
+            data.skills = text
+            logger.info("Skills received: %s", text)
+            await retry_send_message(
+                bot.send_message,
+                message.chat.id,
+                "Great! Where are you located? (e.g., Nairobi, Mombasa)"
+            )
+            data.state = State.LOCATION
+        elif state == State.LOCATION:
+            data.location = text
+            logger.info("Location received: %s", text)
+            await retry_send_message(
+                bot.send_message,
+                message.chat.id,
+                "What's your budget in KES? (e.g., 5000, 10000, or any amount)"
+            )
+            data.state = State.BUDGET
+        elif state == State.BUDGET:
+            budget = parse_budget(text)
+            if budget is None:
+                await retry_send_message(
+                    bot.send_message,
+                    message.chat.id,
+                    "Please enter your budget as a single amount in KES (e.g., 5000)."
+                )
+                return
+            data.budget = budget
+            logger.info("Budget received: %s", data.budget)
+            await retry_send_message(
+                bot.send_message,
+                message.chat.id,
+                "What are your goals? (e.g., earn 20000/month, start a business)"
+            )
+            data.state = State.GOALS
+        elif state == State.GOALS:
+            if not await check_rate_limit(user_id):
+                await retry_send_message(bot.send_message, message.chat.id, RATE_LIMITED_MESSAGE)
+                return
+            data.goals = text
+            logger.info("Goals received: %s", text)
+            if not await present_ideas(message, data):
+                return
+        elif state == State.EXPLORE_IDEA:
+            if not await check_rate_limit(user_id):
+                await retry_send_message(bot.send_message, message.chat.id, RATE_LIMITED_MESSAGE)
+                return
+            data.custom_idea = text
+            logger.info("Custom idea received: %s", text)
+            prompt = (
+                f"{describe_profile(data)}\n\n"
+                f"Evaluate the following side hustle idea for this person: {text}. "
+                f"Provide a concise feasibility analysis with steps to start, potential challenges, and budget use."
+            )
+            logger.debug("Sending custom idea prompt to Gemini: %s", prompt)
+            try:
+                cleaned_response = await stream_reply(
+                    message.chat.id,
+                    model,
+                    prompt,
+                    "What would you like to do next?",
+                    lambda text: NEXT_STEP_KB
+                )
+                logger.debug("Gemini response: %s", cleaned_response)
+            except Exception as e:
+                log_failure("Gemini error: %s", e)
+                await retry_send_message(
+                    bot.send_message,
+                    message.chat.id,
+                    "Sorry, I couldn't evaluate your idea right now. Try again or use /cancel."
+                )
+                await user_data.pop(user_id)
+                return
+
+            data.state = State.ASK_QUESTION
+        elif state == State.ASK_QUESTION:
+            if not await check_rate_limit(user_id):
+                await retry_send_message(bot.send_message, message.chat.id, RATE_LIMITED_MESSAGE)
+                return
+            data.question = text
+            logger.info("Question received: %s", text)
+            prompt = (
+                f"{describe_profile(data)}\n\n"
+                f"Answer the following question about side hustle ideas for this person: {text}"
+            )
+            logger.debug("Sending question prompt to Gemini: %s", prompt)
+            try:
+                remaining_ideas = ideas_left(data.idea_headings, data.explored_mask)
+                keyboard = build_next_keyboard(data.idea_headings, data.explored_mask, ask_button=ASK_AGAIN_BTN)
+                key = question_key(data, text)
+                cleaned_response, claimed = await answers_cache.get_or_claim(key)
+                if cleaned_response is not None:
+                    logger.info("Serving answer from cache")
+                    await send_long_message(
+                        message.chat.id,
+                        f"{cleaned_response}\n\nAnything else you'd like to do?",
+                        reply_markup=keyboard
+                    )
+                else:
+                    try:
+                        cleaned_response = await stream_reply(
+                            message.chat.id,
+                            model,
+                            prompt,
+                            "Anything else you'd like to do?",
+                            lambda text: keyboard
+                        )
+                        await answers_cache.set(key, cleaned_response)
+                    finally:
+                        if claimed:
+                            await answers_cache.release(key)
+                logger.debug("Gemini response: %s", cleaned_response)
+            except Exception as e:
+                log_failure("Gemini error: %s", e)
+                await retry_send_message(
+                    bot.send_message,
+                    message.chat.id,
+                    "Sorry, I couldn't answer right now. Try again or use /cancel."
+                )
+                await user_data.pop(user_id)
+                return
+
+            if not remaining_ideas:
+                data.state = State.CUSTOM_IDEA
+        await user_data.set(user_id, data)
+    except Exception as e:
+        log_failure("Error in message handler: %s", e)
+        await retry_send_message(
+            bot.send_message,
+            message.chat.id,
+            f"Error: {str(e)}. Please try again or use /cancel."
+        )
+        await user_data.pop(user_id)
+
+async def _cb_start_new(call, data):
+    await retry_send_message(
+        bot.send_message,
+        call.message.chat.id,
+        "Starting new conversation..."
+    )
+    await start(call.message)
+
+async def _cb_explore_idea(call, data):
+    user_id = call.from_user.id
+    idea_num = int(call.data.split('_')[-1])
+    if data.explored_mask & (1 << (idea_num - 1)):
+        await retry_send_message(
+            bot.send_message,
+            call.message.chat.id,
+            "You've already explored this idea. Choose another or ask a question!"
+        )
+        return
+    if not await check_rate_limit(user_id):
+        await retry_send_message(bot.send_message, call.message.chat.id, RATE_LIMITED_MESSAGE)
+        return
+    data.explored_mask |= 1 << (idea_num - 1)
+    prompt = explore_prompt(data.idea_headings[idea_num-1], data)
+    logger.debug("Sending explore idea prompt to Gemini: %s", prompt)
+    try:
+        remaining_ideas = ideas_left(data.idea_headings, data.explored_mask)
+        keyboard = build_next_keyboard(data.idea_headings, data.explored_mask)
+        cleaned_response = await prefetched_text(prompt)
+        if cleaned_response is not None:
+            await send_long_message(
+                call.message.chat.id,
+                f"{cleaned_response}\n\nWhat would you like to do next?",
+                reply_markup=keyboard
+            )
+        else:
+            cleaned_response = await stream_reply(
+                call.message.chat.id,
+                model,
+                prompt,
+                "What would you like to do next?",
+                lambda text: keyboard
+            )
+            await details_cache.set(prompt, cleaned_response)
+        logger.debug("Gemini response: %s", cleaned_response)
+    except Exception as e:
+        log_failure("Gemini error: %s", e)
+        await retry_send_message(
+            bot.send_message,
+            call.message.chat.id,
+            "Sorry, I couldn't explore this idea right now. Try again or use /cancel."
+        )
+        await user_data.pop(user_id)
+        return
+
+    data.state = State.ASK_QUESTION if remaining_ideas else State.CUSTOM_IDEA
+    await user_data.set(user_id, data)
+
+async def _cb_custom_idea(call, data):
+    await retry_send_message(
+        bot.send_message,
+        call.message.chat.id,
+        "Awesome! What's your own side hustle idea? (e.g., start a small shop, offer tutoring)"
+    )
+    data.state = State.EXPLORE_IDEA
+    await user_data.set(call.from_user.id, data)
+
+async def _cb_ask_question(call, data):
+    await retry_send_message(
+        bot.send_message,
+        call.message.chat.id,
+        "Sure! What question do you have about the ideas?"
+    )
+    data.state = State.ASK_QUESTION
+    await user_data.set(call.from_user.id, data)
+
+async def _cb_end_conversation(call, data):
+    upsell = UPSELL_TEXT if data and data.is_high_goal else ""
+    await retry_send_message(
+        bot.send_message,
+        call.message.chat.id,
+        f"Thanks for exploring with AnzaBiz AI! {upsell}\nLoved these ideas? Take the next step to start earning faster!",
+        reply_markup=END_CONV_KB
+    )
+
+async def _cb_unknown(call, data):
+    await retry_send_message(
+        bot.send_message,
+        call.message.chat.id,
+        "Sorry, something went wrong. Try again."
+    )
+
+# Callback data -> handler(call, session) for buttons that depend on the session
+CALLBACK_HANDLERS = {
+    "start_new": _cb_start_new,
+    "custom_idea": _cb_custom_idea,
+    "ask_question": _cb_ask_question,
+    "end_conversation": _cb_end_conversation,
+}
+
+@bot.callback_query_handler(func=lambda call: True)
+@acknowledge_callback
+@one_update_per_user
+async def callback_handler(call):
+    user_id = call.from_user.id
+    try:
+        static_reply = STATIC_CALLBACK_REPLIES.get(call.data)
+        if static_reply is not None:
+            text, keyboard = static_reply
+            await retry_send_message(bot.send_message, call.message.chat.id, text, reply_markup=keyboard)
+            if call.data == "final_end":
+                await user_data.pop(user_id)
+            return
+        handler = CALLBACK_HANDLERS.get(call.data)
+        if handler is None:
+            # explore_idea_{n} carries the idea number, so it can't be a table key
+            handler = _cb_explore_idea if call.data.startswith("explore_idea_") else _cb_unknown
+        data = await user_data.get(user_id)
+        await handler(call, data)
+    except Exception as e:
+        log_failure("Error in callback handler: %s", e)
+        await retry_send_message(
+            bot.send_message,
+            call.message.chat.id,
+            "Sorry, something went wrong. Try again."
+        )
+
+async def warm_up():
+    """Open the Telegram and Gemini connections, side by side, before the first user needs them."""
+    results = await asyncio.gather(
+        bot.get_me(),
+        model.generate_content_async("ping", generation_config={"max_output_tokens": 1}, request_options={"timeout": 5}),
+        return_exceptions=True
+    )
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        logger.warning("Warm-up failed: %s", errors[0])
+    else:
+        logger.info("Warm-up complete")
+
+async def healthz(request):
+    """Liveness probe: 503 once polling has stopped, 200 otherwise."""
+    # AsyncTeleBot only exposes its polling state as this attribute
+    if USE_POLLING and not getattr(bot, '_polling', False):
+        return web.Response(status=503, text="polling stopped")
+    return web.Response(text="ok")
+
+async def start_health_server():
+    """Serve /healthz on HEALTH_PORT and return the runner to clean up on exit."""
+    app = web.Application()
+    app.router.add_get('/healthz', healthz)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', int(HEALTH_PORT)).start()
+    logger.info("Health check listening on port %s", HEALTH_PORT)
+    return runner
+
+async def main():
+    await warm_up()
+    health = await start_health_server() if HEALTH_PORT else None
+    try:
+        if USE_POLLING:
+            logger.info("Starting bot in polling mode")
+            # Drop updates that queued up while the bot was down, but not on restarts
+            skip_pending = True
+            while True:
+                try:
+                    # Long poll: Telegram holds getUpdates open up to timeout seconds and
+                    # answers as soon as an update arrives; the HTTP read must outlast it
+                    await bot.infinity_polling(timeout=60, request_timeout=90, skip_pending=skip_pending)
+                except Exception as e:
+                    logger.error("Polling error: %s", e, exc_info=True)
+                skip_pending = False
+                # Restart right away; infinity_polling already backs off on API errors
+                await asyncio.sleep(1)
+        else:
+            # setWebhook is called once here; Telegram pushes updates from then on
+            logger.info("Starting bot in webhook mode on port %s", PORT)
+            await bot.run_webhooks(
+                listen='0.0.0.0',
+                port=PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=WEBHOOK_URL,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+    finally:
+        if health is not None:
+            await health.cleanup()
+        await bot.close_session()
+
+if __name__ == '__main__':
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
@@ -1,31 +1,43 @@
+import functools
 import os
+import httpx
 from telegram.ext import Application, CommandHandler
+from telegram.request import HTTPXRequest
 import logging
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# Logging is configured by the entry point (app.py)
 logger = logging.getLogger(__name__)
 
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 
 async def start(update, context):
-    logger.info(f"Received /start command from user {update.effective_user.id}")
+    logger.info("Received /start command from user %s", update.effective_user.id)
     try:
         await update.message.reply_text("Basic bot test: Hello from HustleForge!")
         logger.info("Sent basic start response")
     except Exception as e:
-        logger.error(f"Error in start handler: {str(e)}", exc_info=True)
+        logger.error("Error in start handler: %s", e, exc_info=True)
 
 async def error_handler(update, context):
-    logger.error(f"Update {update} caused error: {context.error}", exc_info=True)
+    logger.error("Update %s caused error: %s", update, context.error, exc_info=True)
 
+START_HANDLER = CommandHandler('start', start)
+
+@functools.lru_cache(maxsize=1)
 def main():
+    """Build the Telegram Application once; later calls return the same instance."""
     if not TELEGRAM_TOKEN:
         logger.error("TELEGRAM_BOT_TOKEN not set")
         raise ValueError("TELEGRAM_BOT_TOKEN not set")
 
     logger.info("Building Telegram Application")
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
-    application.add_handler(CommandHandler('start', start))
+    # One pooled httpx client with keep-alive for every Bot API call
+    request = HTTPXRequest(
+        read_timeout=30,
+        httpx_kwargs={"limits": httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=75)},
+    )
+    application = Application.builder().token(TELEGRAM_TOKEN).request(request).build()
+    application.add_handler(START_HANDLER)
     application.add_error_handler(error_handler)
     logger.info("Handlers registered successfully")
     return application
\ No newline at end of file
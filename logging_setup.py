@@ -0,0 +1,13 @@
+import logging
+import os
+
+# Default log level per ENV (INFO for anything unlisted); LOG_LEVEL overrides it
+DEFAULT_LOG_LEVELS = {'development': 'DEBUG', 'production': 'WARNING'}
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+def setup_logging(env=None):
+    """Configure the root logger for env, read from ENV when not given."""
+    if env is None:
+        env = os.getenv('ENV', 'development')
+    level = os.getenv('LOG_LEVEL') or DEFAULT_LOG_LEVELS.get(env, 'INFO')
+    logging.basicConfig(level=level.upper(), format=LOG_FORMAT)
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# bot.py reads its configuration at import time
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:TEST')
+os.environ.setdefault('GEMINI_API_KEY', 'test-key')
+os.environ.setdefault('WEBHOOK_URL', 'https://example.com/telegram')
+os.environ.pop('REDIS_URL', None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
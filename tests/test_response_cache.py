@@ -0,0 +1,16 @@
+import asyncio
+
+import bot
+
+
+def test_claim_outlives_claim_ttl_while_held():
+    async def scenario():
+        cache = bot.ResponseCache(None, 'test', claim_ttl=0.3)
+        assert await cache.get_or_claim('prompt') == (None, True)
+        # A slow generation: the claim must still be held well past claim_ttl
+        await asyncio.sleep(1)
+        assert await cache.get_or_claim('prompt', wait=0.2) == (None, False)
+        await cache.set('prompt', 'reply')
+        await cache.release('prompt')
+        assert await cache.get_or_claim('prompt') == ('reply', False)
+    asyncio.run(scenario())
@@ -0,0 +1,39 @@
+import asyncio
+import types
+from unittest import mock
+
+import bot
+
+
+class FakeModel:
+    """Streams the given pieces as Gemini chunks."""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+    async def generate_content_async(self, prompt, **kwargs):
+        async def stream():
+            for piece in self.pieces:
+                yield types.SimpleNamespace(parts=[piece], text=piece)
+        return stream()
+
+
+def test_overflowing_stream_notifies_once(monkeypatch):
+    # No rate-limit waits and no timed edits: only overflow sends new messages
+    monkeypatch.setattr(bot, 'CHAT_RATE', 1000)
+    monkeypatch.setattr(bot, 'CHAT_BURST', 1000)
+    monkeypatch.setattr(bot, 'STREAM_EDIT_INTERVAL', 3600)
+    paragraphs = [letter * 3000 for letter in 'abc']
+    model = FakeModel([paragraphs[0], '\n\n' + paragraphs[1], '\n\n' + paragraphs[2]])
+    sent = types.SimpleNamespace(message_id=1)
+    with mock.patch.object(bot.bot, 'send_message', mock.AsyncMock(return_value=sent)) as send_message, \
+            mock.patch.object(bot.bot, 'edit_message_text', mock.AsyncMock()) as edit_message_text:
+        text = asyncio.run(bot.stream_reply(-100, model, 'prompt', 'footer', lambda text: None))
+
+    assert text == '\n'.join(paragraphs)
+    # The placeholder is edited into part 1; parts 2 and 3 are new messages
+    assert edit_message_text.await_count == 1
+    placeholder, *continuations = send_message.await_args_list
+    assert not placeholder.kwargs.get('disable_notification')
+    assert len(continuations) == 2
+    assert all(call.kwargs.get('disable_notification') for call in continuations)
@@ -0,0 +1,39 @@
+import asyncio
+from unittest import mock
+from urllib.parse import urlparse
+
+from fastapi.testclient import TestClient
+from telebot.ext.aio import AsyncWebhookListener
+
+import bot
+
+
+def test_webhook_path_is_normalized():
+    assert bot.WEBHOOK_PATH == 'telegram/'
+    assert bot.WEBHOOK_URL == 'https://example.com/telegram/'
+
+
+def test_listener_serves_registered_webhook_url():
+    # Start the webhook the way main() does, without setWebhook or uvicorn
+    with mock.patch.object(bot.bot, 'set_webhook', mock.AsyncMock()) as set_webhook, \
+            mock.patch.object(AsyncWebhookListener, 'run_app', mock.AsyncMock()):
+        asyncio.run(bot.bot.run_webhooks(
+            listen='0.0.0.0',
+            port=bot.PORT,
+            url_path=bot.WEBHOOK_PATH,
+            webhook_url=bot.WEBHOOK_URL,
+            max_connections=bot.WEBHOOK_MAX_CONNECTIONS
+        ))
+    registered = set_webhook.call_args.kwargs
+    assert registered['url'] == bot.WEBHOOK_URL
+
+    # Post where Telegram will, with the secret token it was given
+    with mock.patch.object(bot.bot, 'process_new_updates', mock.AsyncMock()):
+        client = TestClient(bot.bot.webhook_listener.app)
+        response = client.post(
+            urlparse(registered['url']).path,
+            json={'update_id': 1},
+            headers={'X-Telegram-Bot-Api-Secret-Token': registered['secret_token']},
+            follow_redirects=False
+        )
+    assert response.status_code == 200